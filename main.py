@@ -1,8 +1,18 @@
+import codecs
+import io
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.json as pajson
 import requests
+import requests_cache
 import streamlit as st
-import pandas as pd
-from urllib.parse import urlparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlparse
 from requests.adapters import HTTPAdapter
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from urllib3.util.retry import Retry
 
 # Configures the page in ‘wide’ mode with a title and an icon
@@ -12,6 +22,26 @@ st.set_page_config(
     layout='wide'
 )
 
+# Maximum number of pages fetched at the same time
+MAX_WORKERS = 16
+# Number of keep-alive connections kept open per host, larger than MAX_WORKERS
+POOL_SIZE = 32
+# Name of the SQLite file caching the REST API responses
+CACHE_NAME = 'wp_cache'
+# Maximum number of articles displayed in the table
+PREVIEW_ROWS = 1000
+# Types of the post fields, parsed straight from the JSON of each page
+POSTS_SCHEMA = pa.schema([
+    ('posts', pa.list_(pa.struct([
+        ('link', pa.string()),
+        ('title', pa.struct([('rendered', pa.string())])),
+        ('content', pa.struct([('rendered', pa.string())])),
+        ('featured_media', pa.int64()),
+        ('categories', pa.list_(pa.int64())),
+        ('tags', pa.list_(pa.int64())),
+    ]))),
+])
+
 
 def validate_wordpress_site(url):
     """Validate that the URL is a WordPress site with an accessible REST API."""
@@ -24,47 +54,97 @@ def validate_wordpress_site(url):
     api_url = f"{parsed_url.scheme}://{parsed_url.netloc}/wp-json/"
 
     try:
-        response = requests.get(api_url, timeout=30)
-        if response.status_code == 200:
-            return True, ""
-        else:
-            return False, f"REST API returned status code {response.status_code}."
+        check_rest_api(api_url)
+        return True, ""
+    except requests.exceptions.HTTPError as e:
+        return False, str(e)
     except requests.exceptions.RequestException as e:
         return False, f"Could not connect to the REST API: {e}"
 
 
-def fetch_all_pages(base_url, params, status_text, item_name, session):
-    """Fetch all pages of a WordPress REST API endpoint."""
-    all_items = []
-    page = 1
+@st.cache_data(ttl=3600, show_spinner=False)
+def check_rest_api(api_url):
+    """Check that the REST API answers, raising an exception otherwise so only successes are cached."""
+    # Only the status code matters, so avoid downloading the discovery document
+    response = requests.head(api_url, timeout=10, allow_redirects=True)
+    if response.status_code == 405:
+        # HEAD is not allowed, fall back to a GET without reading the body
+        response = requests.get(api_url, stream=True, timeout=10)
+        response.close()
+    if response.status_code != 200:
+        raise requests.exceptions.HTTPError(f"REST API returned status code {response.status_code}.",
+                                            response=response)
 
-    while True:
-        params['page'] = page
-        try:
-            response = session.get(base_url, params=params, timeout=30)
-            if response.status_code == 200:
-                items = response.json()
-                all_items.extend(items)
 
-                total_pages = int(response.headers.get('X-WP-TotalPages', 1))
+def fetch_page(page_url, page, session):
+    """Fetch a single page of a WordPress REST API endpoint."""
+    return session.get(f'{page_url}&page={page}', timeout=30)
+
+
+def response_body(response):
+    """Return the body of a response without the UTF-8 BOM some WordPress sites prepend."""
+    # Neither orjson nor the pyarrow JSON reader accept a BOM
+    return response.content.removeprefix(codecs.BOM_UTF8)
+
+
+def check_page_response(response, page):
+    """Raise an HTTPError if a page of a REST API endpoint was not fetched successfully."""
+    if response.status_code != 200:
+        raise requests.exceptions.HTTPError(
+            f'REST API returned status code {response.status_code} for page {page}.', response=response)
+
+
+def iter_pages(base_url, params, status_text, item_name, session):
+    """Yield the raw JSON body of each page of a WordPress REST API endpoint, in page order.
+
+    The total number of items is yielded along with each page. Later pages keep
+    downloading in the background while the caller processes earlier ones. A page
+    that cannot be fetched raises a requests.exceptions.RequestException.
+    """
+    # Encode the query once, only the page number changes between requests
+    page_url = f'{base_url}?{urlencode(params)}'
+
+    # Fetch the first page to find out how many pages there are
+    response = fetch_page(page_url, 1, session)
+    check_page_response(response, 1)
+
+    total_pages = int(response.headers.get('X-WP-TotalPages', 1))
+    total_items = int(response.headers.get('X-WP-Total', total_pages * params.get('per_page', 10)))
+    if status_text:
+        status_text.text(f'Fetching {item_name}: Page 1/{total_pages}')
+
+    # Fetch the remaining pages concurrently, yielding them in page order. Only
+    # MAX_WORKERS pages are in flight at a time, so consumed pages are not kept in memory.
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    futures = deque(executor.submit(fetch_page, page_url, page, session)
+                    for page in range(2, min(total_pages, MAX_WORKERS + 1) + 1))
+    try:
+        yield response_body(response), total_items
+
+        for page in range(2, total_pages + 1):
+            future = futures.popleft()
+            if page + MAX_WORKERS <= total_pages:
+                futures.append(executor.submit(fetch_page, page_url, page + MAX_WORKERS, session))
+            response = future.result()
+            check_page_response(response, page)
+
+            if status_text:
                 status_text.text(f'Fetching {item_name}: Page {page}/{total_pages}')
+            yield response_body(response), total_items
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
-                if page >= total_pages:
-                    break
-                else:
-                    page += 1
-            else:
-                st.error(f'Error {response.status_code} while fetching {item_name} page {page}')
-                break
-        except requests.exceptions.RequestException as e:
-            st.error(f'An error occurred while fetching {item_name}: {e}')
-            break
 
+def fetch_all_pages(base_url, params, status_text, item_name, session):
+    """Fetch all pages of a WordPress REST API endpoint."""
+    all_items = []
+    for content, _ in iter_pages(base_url, params, status_text, item_name, session):
+        all_items.extend(orjson.loads(content))
     return all_items
 
 
-def fetch_all_published_posts(base_site_url, status_text, session, categories_option, tags_option):
-    """Fetch all published posts from the WordPress site."""
+def iter_published_posts(base_site_url, status_text, session, categories_option, tags_option):
+    """Yield the published posts of the WordPress site as a record batch per page."""
     base_url = f'{base_site_url}/wp-json/wp/v2/posts'
     fields = ['link', 'title', 'content', 'featured_media']
     if categories_option:
@@ -75,57 +155,179 @@ def fetch_all_published_posts(base_site_url, status_text, session, categories_op
         'status': 'publish',
         'per_page': 100,
         '_fields': ','.join(fields),
-        '_embed': 'wp:featuredmedia',  # Include embedded media data
+        'context': 'view',
     }
-    return fetch_all_pages(base_url, params, status_text, 'articles', session)
-
-
-def fetch_all_categories(base_site_url, status_text, session):
-    """Fetch all categories from the WordPress site."""
+    try:
+        for content, total_posts in iter_pages(base_url, params, status_text, 'articles', session):
+            yield parse_posts(content), total_posts
+    except requests.exceptions.RequestException as e:
+        # Stop at the first page that fails, keeping the articles processed so far
+        st.error(f'An error occurred while fetching articles: {e}')
+
+
+def parse_posts(content):
+    """Parse the JSON body of a page of posts straight into an Arrow record batch."""
+    # Wrap the JSON array in an object, so the page is parsed as a single row
+    data = b'{"posts":' + content + b'}'
+    table = pajson.read_json(
+        io.BytesIO(data),
+        read_options=pajson.ReadOptions(block_size=len(data)),
+        parse_options=pajson.ParseOptions(explicit_schema=POSTS_SCHEMA, newlines_in_values=True,
+                                          unexpected_field_behavior='ignore'),
+    )
+    return pa.RecordBatch.from_struct_array(table.column('posts').combine_chunks().flatten())
+
+
+def fetch_by_ids(base_url, ids, params, item_name, session):
+    """Fetch the items with the given IDs from a WordPress REST API endpoint.
+
+    Raises a requests.exceptions.RequestException if any request fails, so a partial
+    result is never returned (and never cached by the callers).
+    """
+    # Remove duplicates while keeping the order of the IDs
+    ids = list(dict.fromkeys(ids))
+    items = []
+    # The REST API accepts at most 100 IDs per request
+    for start in range(0, len(ids), 100):
+        chunk = ids[start:start + 100]
+        chunk_params = {
+            **params,
+            'include': ','.join(map(str, chunk)),
+            'per_page': 100,
+        }
+        items.extend(fetch_all_pages(base_url, chunk_params, None, item_name, session))
+    return items
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_categories_by_ids(base_site_url, ids, _session):
+    """Fetch the names of the given category IDs from the WordPress site."""
     base_url = f'{base_site_url}/wp-json/wp/v2/categories'
     params = {
-        'per_page': 100,
+        '_fields': 'id,name',
     }
-    categories = fetch_all_pages(base_url, params, status_text, 'categories', session)
+    categories = fetch_by_ids(base_url, ids, params, 'categories', _session)
     # Create a dictionary mapping category ID to name
-    category_dict = {cat['id']: cat['name'] for cat in categories}
-    status_text.text('All categories have been fetched.')
-    return category_dict
+    return {cat['id']: cat['name'] for cat in categories}
 
 
-def fetch_all_tags(base_site_url, status_text, session):
-    """Fetch all tags from the WordPress site."""
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_tags_by_ids(base_site_url, ids, _session):
+    """Fetch the names of the given tag IDs from the WordPress site."""
     base_url = f'{base_site_url}/wp-json/wp/v2/tags'
     params = {
-        'per_page': 100,
+        '_fields': 'id,name',
     }
-    tags = fetch_all_pages(base_url, params, status_text, 'tags', session)
+    tags = fetch_by_ids(base_url, ids, params, 'tags', _session)
     # Create a dictionary mapping tag ID to name
-    tag_dict = {tag['id']: tag['name'] for tag in tags}
-    status_text.text('All tags have been fetched.')
-    return tag_dict
-
-
-def get_image_url(post, base_site_url, session):
-    """Get image URL from embedded media or by fetching the media endpoint."""
-    image_url = ''
-    if post.get('featured_media'):
-        # Try to get the image URL from embedded media
-        embedded_media = post.get('_embedded', {}).get('wp:featuredmedia', [])
-        if embedded_media and 'source_url' in embedded_media[0]:
-            image_url = embedded_media[0]['source_url']
-        else:
-            # Fallback: Fetch the media data directly with retries
-            media_id = post.get('featured_media')
-            media_url = f"{base_site_url}/wp-json/wp/v2/media/{media_id}"
-            try:
-                response = session.get(media_url, timeout=30)
-                if response.status_code == 200:
-                    media_data = response.json()
-                    image_url = media_data.get('source_url', '')
-            except requests.exceptions.RequestException as e:
-                st.warning(f"Failed to fetch media ID {media_id}: {e}")
-    return image_url
+    return {tag['id']: tag['name'] for tag in tags}
+
+
+def fetch_media_by_ids(base_site_url, ids, session):
+    """Fetch the source URLs of the given media IDs from the WordPress site."""
+    base_url = f'{base_site_url}/wp-json/wp/v2/media'
+    params = {
+        '_fields': 'id,source_url',
+    }
+    media = fetch_by_ids(base_url, ids, params, 'images', session)
+    # Create a dictionary mapping media ID to source URL
+    return {item['id']: item.get('source_url', '') for item in media}
+
+
+def missing_ids(ids, known):
+    """Return the unique IDs, in order, that are not keys of the known mapping."""
+    return [item_id for item_id in dict.fromkeys(ids) if item_id not in known]
+
+
+def fetch_page_lookups(base_site_url, posts, category_dict, tag_dict, media_map, categories_option, tags_option,
+                       session, executor):
+    """Fetch the unknown categories, tags and images of a page of posts at the same time."""
+    lookups = []
+    if categories_option:
+        category_ids = missing_ids(unique_ids(posts.column('categories')), category_dict)
+        lookups.append(('categories', category_dict, category_ids, 'Unknown',
+                        executor.submit(fetch_categories_by_ids, base_site_url, category_ids, session)))
+    if tags_option:
+        tag_ids = missing_ids(unique_ids(posts.column('tags')), tag_dict)
+        lookups.append(('tags', tag_dict, tag_ids, 'Unknown',
+                        executor.submit(fetch_tags_by_ids, base_site_url, tag_ids, session)))
+    featured_media = pc.unique(posts.column('featured_media')).drop_null().to_pylist()
+    media_ids = missing_ids((media_id for media_id in featured_media if media_id), media_map)
+    lookups.append(('images', media_map, media_ids, '',
+                    executor.submit(fetch_media_by_ids, base_site_url, media_ids, session)))
+
+    # Wait for all the lookups before the page is converted
+    for item_name, known, ids, default, future in lookups:
+        try:
+            found = future.result()
+        except requests.exceptions.RequestException as e:
+            # Leave the IDs unknown, so they are requested again with the next page
+            st.error(f'An error occurred while fetching {item_name}: {e}')
+            continue
+        # Remember IDs the API did not return too, so they are not requested again
+        known.update(dict.fromkeys(ids, default))
+        known.update(found)
+
+
+def lookup(ids, mapping, default):
+    """Map an array of IDs to the values of the mapping, using default for unknown IDs."""
+    known_ids = pa.array(mapping.keys(), type=pa.int64())
+    known_values = pa.array(mapping.values(), type=pa.string())
+    positions = pc.index_in(ids, value_set=known_ids)
+    return pc.take(known_values, positions).fill_null(default)
+
+
+def map_ids_to_names(id_lists, names):
+    """Join the names of each list of IDs, using 'Unknown' for IDs without a name."""
+    # Look up the names of all the IDs at once, then rebuild the lists of names
+    mapped = lookup(id_lists.values, names, 'Unknown')
+    name_lists = pa.ListArray.from_arrays(id_lists.offsets, mapped)
+    return pc.binary_join(name_lists, ', ')
+
+
+def unique_ids(id_lists):
+    """Return the unique IDs of an array of lists of IDs."""
+    return pc.unique(pc.list_flatten(id_lists)).to_pylist()
+
+
+def strip_html(content):
+    """Remove the HTML tags of an array of HTML strings and collapse whitespace."""
+    text = pc.replace_substring_regex(content, r'<[^>]+>', ' ')
+    # \p{Z} also matches non-breaking spaces, which \s does not in RE2
+    text = pc.replace_substring_regex(text, r'[\s\p{Z}]+', ' ')
+    return pc.utf8_trim_whitespace(text)
+
+
+def build_batch(posts, media_map, category_dict, tag_dict, categories_option, tags_option, strip_html_option):
+    """Build the record batch of a page of articles, one column at a time."""
+    content = pc.struct_field(posts.column('content'), 'rendered').fill_null('')
+    columns = {
+        'url': posts.column('link').fill_null(''),
+        'title': pc.struct_field(posts.column('title'), 'rendered').fill_null(''),
+        'content': content,
+    }
+    if strip_html_option:
+        columns['content_text'] = strip_html(content)
+    columns['image_url'] = lookup(posts.column('featured_media'), media_map, '')
+    if categories_option:
+        columns['categories'] = map_ids_to_names(posts.column('categories'), category_dict).fill_null('')
+    if tags_option:
+        columns['tags'] = map_ids_to_names(posts.column('tags'), tag_dict).fill_null('')
+    return pa.RecordBatch.from_pydict(columns)
+
+
+def create_session():
+    """Create an HTTP session with retries and a disk cache of the responses."""
+    # Responses are cached on disk, so repeated runs against the same site skip the network
+    session = requests_cache.CachedSession(CACHE_NAME, backend='sqlite', expire_after=3600,
+                                           allowable_codes=(200,))
+    retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # Prefer Brotli, smaller than gzip for JSON and HTML, urllib3 decodes it with the brotli package
+    session.headers['Accept-Encoding'] = 'br, gzip, deflate'
+    return session
 
 
 def main():
@@ -137,6 +339,11 @@ def main():
     # Add sidebar options
     categories_option = st.sidebar.checkbox('Retrieve Categories', value=True)
     tags_option = st.sidebar.checkbox('Retrieve Tags', value=True)
+    strip_html_option = st.sidebar.checkbox('Strip HTML', value=False)
+    if st.sidebar.button('Clear cache'):
+        create_session().cache.clear()
+        st.cache_data.clear()
+        st.sidebar.success('Cache cleared.')
 
     if st.button('Start fetching articles'):
         status_text = st.empty()
@@ -146,85 +353,72 @@ def main():
             st.error(f"URL Validation Error: {error_message}")
             return
 
-        session = requests.Session()
-        retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-        adapter = HTTPAdapter(max_retries=retries)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
+        session = create_session()
 
         with st.spinner('Processing...'):
             try:
-                # Fetch all published posts
-                posts = fetch_all_published_posts(base_site_url, status_text, session, categories_option, tags_option)
-                if not posts:
-                    st.warning('No articles found.')
-                    return
-                st.success(f'Total articles fetched: {len(posts)}')
-
-                # Fetch categories and tags if selected
-                if categories_option:
-                    category_dict = fetch_all_categories(base_site_url, status_text, session)
-                else:
-                    category_dict = {}
-                if tags_option:
-                    tag_dict = fetch_all_tags(base_site_url, status_text, session)
-                else:
-                    tag_dict = {}
-
-                # Prepare to collect post data
-                csv_data = []
-                total_posts = len(posts)
+                # Articles are processed and written to the CSV buffer one page at a time,
+                # while the next pages are still being fetched
+                csv_buffer = pa.BufferOutputStream()
+                csv_writer = None
+                preview = []
+                preview_size = 0
+                index = 0
+                # Names and images found so far, so each ID is only fetched once
+                category_dict = {}
+                tag_dict = {}
+                media_map = {}
                 progress_bar = st.progress(0)
 
-                for index, post in enumerate(posts, start=1):
-                    # Update status and progress bar
-                    status_text.text(f'Processing article {index}/{total_posts}')
-                    progress_bar.progress(index / total_posts)
-
-                    url = post.get('link', '')
-                    title = post.get('title', {}).get('rendered', '')
-                    content = post.get('content', {}).get('rendered', '')
-
-                    # Get image URL from embedded media
-                    image_url = get_image_url(post, base_site_url, session)
-
-                    post_data = {
-                        'url': url,
-                        'title': title,
-                        'content': content,
-                        'image_url': image_url
-                    }
-
-                    # Handle categories if selected
-                    if categories_option:
-                        categories = []
-                        category_ids = post.get('categories', [])
-                        if category_ids:
-                            categories = [category_dict.get(cat_id, 'Unknown') for cat_id in category_ids]
-                        category_names = ', '.join(categories)
-                        post_data['categories'] = category_names
-
-                    # Handle tags if selected
-                    if tags_option:
-                        tags = []
-                        tag_ids = post.get('tags', [])
-                        if tag_ids:
-                            tags = [tag_dict.get(tag_id, 'Unknown') for tag_id in tag_ids]
-                        tag_names = ', '.join(tags)
-                        post_data['tags'] = tag_names
-
-                    csv_data.append(post_data)
+                # Runs the lookups of a page concurrently, with access to the page for errors
+                lookup_executor = ThreadPoolExecutor(max_workers=3, initializer=add_script_run_ctx,
+                                                     initargs=(None, get_script_run_ctx()))
+
+                pages = iter_published_posts(base_site_url, status_text, session, categories_option, tags_option)
+                try:
+                    for posts, total_posts in pages:
+                        if not posts.num_rows:
+                            continue
+
+                        fetch_page_lookups(base_site_url, posts, category_dict, tag_dict, media_map,
+                                           categories_option, tags_option, session, lookup_executor)
+
+                        batch = build_batch(posts, media_map, category_dict, tag_dict, categories_option,
+                                            tags_option, strip_html_option)
+                        if csv_writer is None:
+                            csv_writer = pacsv.CSVWriter(csv_buffer, batch.schema)
+                        csv_writer.write_batch(batch)
+                        # Keep only the first rows for display
+                        if preview_size < PREVIEW_ROWS:
+                            preview.append(batch.slice(0, PREVIEW_ROWS - preview_size))
+                            preview_size += preview[-1].num_rows
+
+                        # Update status and progress bar
+                        index += batch.num_rows
+                        status_text.text(f'Processing article {index}/{total_posts}')
+                        progress_bar.progress(min(index / total_posts, 1.0))
+                finally:
+                    # Release the fetch threads and the CSV writer even when a page fails
+                    pages.close()
+                    lookup_executor.shutdown(cancel_futures=True)
+                    if csv_writer is not None:
+                        csv_writer.close()
+
+                if csv_writer is None:
+                    progress_bar.empty()
+                    st.warning('No articles found.')
+                    return
+                st.success(f'Total articles fetched: {index}')
 
                 progress_bar.empty()
                 status_text.text('Processing completed.')
 
-                # Convert to DataFrame for display and download
-                df = pd.DataFrame(csv_data)
-
-                st.dataframe(df)
+                st.dataframe(pa.Table.from_batches(preview))
+                if index > PREVIEW_ROWS:
+                    st.caption(f'Showing the first {PREVIEW_ROWS} of {index} articles.')
 
                 # Button to download the CSV
-                csv = df.to_csv(index=False).encode('utf-8')
+                csv = csv_buffer.getvalue().to_pybytes()
                 st.download_button(
                     label='Download CSV file',
                     data=csv,